@@ -1,48 +1,207 @@
+import contextlib
 import math
 import os
-from flask import Flask, render_template, request, jsonify
+import sys
+import threading
+from typing import Literal
+import msgpack
+import numpy as np
+import orjson
+from flask import Flask, Response, render_template, request
+from pydantic import BaseModel, PositiveFloat, ValidationError, field_validator, model_validator
+
+try:
+    from numba import njit, prange, threading_layer
+    _HAVE_NUMBA = True
+except ImportError:  # numba is optional; the kernels then run as plain Python
+    _HAVE_NUMBA = False
+    
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
+    
+    prange = range
+
+# Fused multiply-add a * b + c. math.fma (Python 3.13+) cannot be called from numba
+# kernels, where the plain expression is contracted to an FMA under fastmath anyway
+if _HAVE_NUMBA or not hasattr(math, 'fma'):
+    @njit(cache=True, fastmath=True)
+    def _fma(a, b, c):
+        return a * b + c
+else:
+    _fma = math.fma
+
+__all__ = [
+    'app',
+    'calculate_asme_b31g_modified',
+    'calculate_asme_b31g_modified_vec',
+    'calculate_dnv_rp_f101',
+    'calculate_remaining_life',
+]
 
 app = Flask(__name__)
+# Let the WSGI server log unhandled errors instead of formatting them twice
+app.config['PROPAGATE_EXCEPTIONS'] = True
 
-def calculate_asme_b31g_modified(diameter, wall_thickness, defect_length, defect_depth, smys, smts, maop):
+# Decimal places per result field, applied once when the response is built
+_PRECISION = {
+    'd_t': 4, 'z_val': 4, 'lambda_val': 4, 'm_val': 4,
+    's_flow': 2, 'stress_fail': 2, 'pressure_fail': 3, 'erf': 3,
+    'gamma_m': 3, 'gamma_d': 3,
+    'min_critical_depth': 3, 'remaining_life': 2, 'remaining_corrosion_tolerance': 3,
+    'corrosion_rate': 3, 'original_depth': 3, 'wall_thickness': 3
+}
+
+def _format_for_display(results):
+    """Round result fields to their display precision"""
+    return {k: (round(v, _PRECISION[k]) if isinstance(v, float) and k in _PRECISION else v) for k, v in results.items()}
+
+def fastjson(obj, status=200):
+    """Serialize obj with orjson (numpy arrays included) into a JSON response"""
+    return Response(orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY), status=status, mimetype='application/json')
+
+def _msgpack_default(obj):
+    """msgpack hook for numpy arrays and scalars"""
+    if isinstance(obj, (np.ndarray, np.generic)):
+        return obj.tolist()
+    raise TypeError(f'Cannot serialize {type(obj).__name__}')
+
+def negotiated(obj, status=200):
+    """Answer in msgpack when the client asks for it, JSON otherwise"""
+    if request.accept_mimetypes.best_match(['application/json', 'application/msgpack']) == 'application/msgpack':
+        return Response(msgpack.packb(obj, use_bin_type=True, default=_msgpack_default), status=status, mimetype='application/msgpack')
+    return fastjson(obj, status)
+
+# DNV RP F101 partial safety factors per safety class
+# as (gamma_m, gamma_d, gamma_m * gamma_d)
+DNV_SAFETY_FACTORS = {
+    'low': (1.15, 1.0, 1.15),
+    'medium': (1.15, 1.05, 1.2075),
+    'high': (1.15, 1.15, 1.3225)
+}
+
+# Folias factor branch limit for lambda in DNV RP F101
+_SQRT20 = math.sqrt(20.0)
+
+@njit(cache=True, fastmath=True)
+def _kernel_asme(diameter, wall_thickness, defect_length, defect_depth, smys, smts, maop):
     """
-    ASME B31G Modified Method Calculation
+    ASME B31G Modified scalar kernel: (d_t, z_val, s_flow, m_val, stress_fail, pressure_fail, erf)
     """
     # Calculate relative depth
-    d_t = defect_depth / wall_thickness
+    inv_t = 1.0 / wall_thickness
+    d_t = defect_depth * inv_t
     
     # Calculate Z parameter
-    z_val = (defect_length ** 2) / (diameter * wall_thickness)
+    z_val = defect_length * defect_length / (diameter * wall_thickness)
     
     # Calculate Flow Stress
-    s_flow = min(1.1 * smys, smts)
+    s_flow = smts if 1.1 * smys > smts else 1.1 * smys
     
-    # Calculate Folias factor
-    if z_val <= 50:
-        m_val = math.sqrt(1 + 0.6275 * z_val - 0.003375 * z_val ** 2)
+    # Calculate Folias factor (Horner form of 1 + 0.6275 z - 0.003375 z^2)
+    if z_val <= 50.0:
+        m_val = math.sqrt(_fma(z_val, 0.6275 - 0.003375 * z_val, 1.0))
     else:
-        m_val = 0.032 * z_val + 3.3
+        m_val = _fma(0.032, z_val, 3.3)
     
     # Calculate failure stress and pressure
-    stress_fail = s_flow * (1 - 0.85 * d_t) / (1 - 0.85 * d_t / m_val)
-    pressure_fail = 2 * stress_fail * wall_thickness / diameter
+    a = 1.0 - 0.85 * d_t
+    stress_fail = s_flow * a / (1.0 - 0.85 * d_t / m_val)
+    pressure_fail = 2.0 * stress_fail * wall_thickness / diameter
     erf = maop / pressure_fail
     
+    return d_t, z_val, s_flow, m_val, stress_fail, pressure_fail, erf
+
+def calculate_asme_b31g_modified(diameter, wall_thickness, defect_length, defect_depth, smys, smts, maop):
+    """
+    ASME B31G Modified Method Calculation
+    """
+    d_t, z_val, s_flow, m_val, stress_fail, pressure_fail, erf = _kernel_asme(
+        diameter, wall_thickness, defect_length, defect_depth, smys, smts, maop
+    )
+    
     return {
-        'd_t': round(d_t, 4),
-        'z_val': round(z_val, 4),
-        's_flow': round(s_flow, 2),
-        'm_val': round(m_val, 4),
-        'stress_fail': round(stress_fail, 2),
-        'pressure_fail': round(pressure_fail, 3),
-        'erf': round(erf, 3),
+        'd_t': d_t,
+        'z_val': z_val,
+        's_flow': s_flow,
+        'm_val': m_val,
+        'stress_fail': stress_fail,
+        'pressure_fail': pressure_fail,
+        'erf': erf,
         'repair_required': erf >= 1,
         'method': 'ASME B31G Modified'
     }
 
-def calculate_dnv_rp_f101(diameter, wall_thickness, defect_length, defect_depth, smts, maop, safety_class='medium'):
+@njit(cache=True, fastmath=True, parallel=True)
+def _batch_kernel_asme(diameter, wall_thickness, defect_length, defect_depth, smys, smts, maop, out):
     """
-    DNV RP F101 Calculation for corroded pipelines
+    Run _kernel_asme over 1-D arrays on numba's thread pool, one row of out per result field
+    """
+    for i in prange(defect_depth.shape[0]):
+        d_t, z_val, s_flow, m_val, stress_fail, pressure_fail, erf = _kernel_asme(
+            diameter[i], wall_thickness[i], defect_length[i], defect_depth[i], smys[i], smts[i], maop[i]
+        )
+        out[0, i] = d_t
+        out[1, i] = z_val
+        out[2, i] = s_flow
+        out[3, i] = m_val
+        out[4, i] = stress_fail
+        out[5, i] = pressure_fail
+        out[6, i] = erf
+
+# numba's workqueue threading layer (used when neither TBB nor OpenMP is found) must not be
+# entered from several threads at once; the lock is dropped below for thread-safe layers
+_batch_lock = threading.Lock()
+
+def calculate_asme_b31g_modified_vec(diameter, wall_thickness, defect_length, defect_depth, smys, smts, maop):
+    """
+    ASME B31G Modified Method Calculation over arrays of defects
+    """
+    args = (diameter, wall_thickness, defect_length, defect_depth, smys, smts, maop)
+    if _HAVE_NUMBA and np.ndim(defect_depth) == 1 and all(np.shape(x) == np.shape(defect_depth) for x in args):
+        out = np.empty((7, len(defect_depth)))
+        with _batch_lock:
+            _batch_kernel_asme(*(np.ascontiguousarray(x, dtype=np.float64) for x in args), out)
+        d_t, z_val, s_flow, m_val, stress_fail, pressure_fail, erf = out
+        return {
+            'd_t': d_t,
+            'z_val': z_val,
+            's_flow': s_flow,
+            'm_val': m_val,
+            'stress_fail': stress_fail,
+            'pressure_fail': pressure_fail,
+            'erf': erf,
+            'repair_required': erf >= 1
+        }
+    
+    d_t = defect_depth / wall_thickness
+    z_val = defect_length * defect_length / (diameter * wall_thickness)
+    s_flow = np.minimum(1.1 * smys, smts)
+    
+    # Folias factor; clip z inside the sqrt so the unused branch never goes negative
+    z_short = np.minimum(z_val, 50.0)
+    m_val = np.where(z_val <= 50.0, np.sqrt(1.0 + z_short * (0.6275 - 0.003375 * z_short)), 0.032 * z_val + 3.3)
+    
+    stress_fail = s_flow * (1.0 - 0.85 * d_t) / (1.0 - 0.85 * d_t / m_val)
+    pressure_fail = 2.0 * stress_fail * wall_thickness / diameter
+    erf = maop / pressure_fail
+    
+    return {
+        'd_t': d_t,
+        'z_val': z_val,
+        's_flow': s_flow,
+        'm_val': m_val,
+        'stress_fail': stress_fail,
+        'pressure_fail': pressure_fail,
+        'erf': erf,
+        'repair_required': erf >= 1
+    }
+
+@njit(cache=True, fastmath=True)
+def _kernel_dnv(diameter, wall_thickness, defect_length, defect_depth, smts, maop, gamma_prod):
+    """
+    DNV RP F101 scalar kernel: (d_t, lambda_val, m_val, p_fail, utilization)
     """
     # Relative depth
     d_t = defect_depth / wall_thickness
@@ -51,68 +210,156 @@ def calculate_dnv_rp_f101(diameter, wall_thickness, defect_length, defect_depth,
     lambda_val = defect_length / math.sqrt(diameter * wall_thickness)
     
     # Folias factor calculation
-    if lambda_val <= math.sqrt(20):
-        m_val = math.sqrt(1 + 0.6275 * lambda_val**2 - 0.003375 * lambda_val**4)
+    lambda_sq = lambda_val * lambda_val
+    if lambda_val <= _SQRT20:
+        m_val = math.sqrt(_fma(lambda_sq, 0.6275 - 0.003375 * lambda_sq, 1.0))
     else:
-        m_val = 0.032 * lambda_val**2 + 3.3
-    
-    # Safety factors
-    safety_factors = {
-        'low': {'gamma_m': 1.15, 'gamma_d': 1.0},
-        'medium': {'gamma_m': 1.15, 'gamma_d': 1.05},
-        'high': {'gamma_m': 1.15, 'gamma_d': 1.15}
-    }
-    
-    gamma_m = safety_factors[safety_class]['gamma_m']
-    gamma_d = safety_factors[safety_class]['gamma_d']
+        m_val = _fma(0.032, lambda_sq, 3.3)
     
     # Calculate failure pressure (pressure resistance)
-    p_fail = (2 * wall_thickness * smts / (diameter * gamma_m * gamma_d)) * ((1 - d_t) / (1 - d_t / m_val))
+    p_fail = (2 * wall_thickness * smts / (diameter * gamma_prod)) * ((1 - d_t) / (1 - d_t / m_val))
     
     # Calculate utilization factor but call it ERF for consistency
     utilization = maop / p_fail
     
+    return d_t, lambda_val, m_val, p_fail, utilization
+
+def calculate_dnv_rp_f101(diameter, wall_thickness, defect_length, defect_depth, smts, maop, safety_class='medium'):
+    """
+    DNV RP F101 Calculation for corroded pipelines
+    """
+    # Safety factors
+    gamma_m, gamma_d, gamma_prod = DNV_SAFETY_FACTORS[safety_class]
+    
+    d_t, lambda_val, m_val, p_fail, utilization = _kernel_dnv(
+        diameter, wall_thickness, defect_length, defect_depth, smts, maop, gamma_prod
+    )
+    
     return {
-        'd_t': round(d_t, 4),
-        'lambda_val': round(lambda_val, 4),
-        'm_val': round(m_val, 4),
-        'gamma_m': round(gamma_m, 3),
-        'gamma_d': round(gamma_d, 3),
-        'pressure_fail': round(p_fail, 3),
-        'erf': round(utilization, 3),  # Using utilization but calling it ERF
+        'd_t': d_t,
+        'lambda_val': lambda_val,
+        'm_val': m_val,
+        'gamma_m': gamma_m,
+        'gamma_d': gamma_d,
+        'pressure_fail': p_fail,
+        'erf': utilization,  # Using utilization but calling it ERF
         'repair_required': utilization >= 1,
         'method': 'DNV RP F101',
         'safety_class': safety_class
     }
 
-def calculate_remaining_life(diameter, wall_thickness, defect_length, defect_depth, smys, smts, maop, corrosion_rate, method='asme'):
+@njit(cache=True, fastmath=True)
+def _asme_erf_and_derivative(d, diameter, t, L, smys, smts, maop):
+    """
+    ASME B31G Modified ERF and its derivative with respect to defect depth
+    """
+    inv_t = 1.0 / t
+    d_t = d * inv_t
+    z_val = L * L / (diameter * t)
+    s_flow = smts if 1.1 * smys > smts else 1.1 * smys
+    if z_val <= 50.0:
+        m_val = math.sqrt(_fma(z_val, 0.6275 - 0.003375 * z_val, 1.0))
+    else:
+        m_val = _fma(0.032, z_val, 3.3)
+    
+    a = 1.0 - 0.85 * d_t
+    b = 1.0 - 0.85 * d_t / m_val
+    stress_fail = s_flow * a / b
+    erf = maop * diameter * 0.5 * inv_t / stress_fail
+    
+    # d(stress)/d(d), then chain rule through erf = maop * D / (2 * t * stress)
+    d_stress = 0.85 * inv_t * s_flow * (a / m_val - b) / (b * b)
+    d_erf = -erf * d_stress / stress_fail
+    return erf, d_erf
+
+@njit(cache=True, fastmath=True)
+def _dnv_erf_and_derivative(d, diameter, t, L, smts, maop, gamma_prod):
+    """
+    DNV RP F101 utilization and its derivative with respect to defect depth
+    """
+    d_t = d / t
+    lambda_val = L / math.sqrt(diameter * t)
+    lambda_sq = lambda_val * lambda_val
+    if lambda_val <= _SQRT20:
+        m_val = math.sqrt(_fma(lambda_sq, 0.6275 - 0.003375 * lambda_sq, 1.0))
+    else:
+        m_val = _fma(0.032, lambda_sq, 3.3)
+    
+    a = 1 - d_t
+    b = 1 - d_t / m_val
+    p_fail = (2 * t * smts / (diameter * gamma_prod)) * a / b
+    erf = maop / p_fail
+    
+    # erf is inversely proportional to a / b, so d(erf)/d(d) = -erf * (a / b)' / (a / b)
+    d_ratio = (-b / t + a / (t * m_val)) / b ** 2
+    d_erf = -erf * d_ratio * b / a
+    return erf, d_erf
+
+# Compile (or load from cache) the jitted kernels at import so the first request does not pay for it
+_kernel_asme(506.0, 6.35, 200.0, 2.5, 360.0, 455.0, 1.5)
+_kernel_dnv(506.0, 6.35, 200.0, 2.5, 455.0, 1.5, 1.2075)
+_asme_erf_and_derivative(2.5, 506.0, 6.35, 200.0, 360.0, 455.0, 1.5)
+_dnv_erf_and_derivative(2.5, 506.0, 6.35, 200.0, 455.0, 1.5, 1.2075)
+if _HAVE_NUMBA:
+    calculate_asme_b31g_modified_vec(*(np.array([x]) for x in (506.0, 6.35, 200.0, 2.5, 360.0, 455.0, 1.5)))
+    # The threading layer is only known once a parallel kernel has run
+    if threading_layer() != 'workqueue':
+        _batch_lock = contextlib.nullcontext()
+
+def calculate_remaining_life(diameter, wall_thickness, defect_length, defect_depth, smys, smts, maop, corrosion_rate, method='asme', safety_class='medium', precomputed_erf=None):
     """
     Calculate remaining life and critical defect depth
+    
+    precomputed_erf is the ERF already evaluated at defect_depth, if known
     """
     original_depth = defect_depth
     min_critical_depth = 0.2 * wall_thickness
     
-    # Find critical depth using binary search
+    # Find critical depth (ERF = 1) using Newton-Raphson, safeguarded by the bisection bracket
     low, high = max(defect_depth, min_critical_depth), wall_thickness
     critical_depth = high
     
-    for _ in range(50):  # 50 iterations for precision
-        mid = (low + high) / 2
-        
-        if method == 'asme':
-            results = calculate_asme_b31g_modified(diameter, wall_thickness, defect_length, mid, smys, smts, maop)
-            factor = results['erf']
-        else:
-            results = calculate_dnv_rp_f101(diameter, wall_thickness, defect_length, mid, smts, maop)
-            factor = results['erf']
+    # Select the scalar kernel once; the loop only needs ERF and its slope
+    if method == 'asme':
+        def erf_fn(d):
+            return _asme_erf_and_derivative(d, diameter, wall_thickness, defect_length, smys, smts, maop)
+    else:
+        gamma_prod = DNV_SAFETY_FACTORS[safety_class][2]
         
-        if abs(factor - 1.0) < 0.001:
-            critical_depth = mid
-            break
-        elif factor < 1.0:
-            low = mid
+        def erf_fn(d):
+            return _dnv_erf_and_derivative(d, diameter, wall_thickness, defect_length, smts, maop, gamma_prod)
+    
+    if precomputed_erf is not None and precomputed_erf >= 1.0:
+        # Defect already fails at its current depth
+        critical_depth = max(original_depth, min_critical_depth)
+    else:
+        # ERF grows with depth, so a root lies in the bracket only if ERF(low) < 1 <= ERF(high).
+        # DNV ERF is unbounded at the full wall thickness; only ASME can stay below 1 there
+        factor, slope = erf_fn(low)
+        if factor >= 1.0:
+            critical_depth = low
+        elif method == 'asme' and erf_fn(high)[0] < 1.0:
+            critical_depth = high
         else:
-            high = mid
+            mid = low
+            
+            for _ in range(50):
+                # Fall back to bisection if the slope is unusable
+                # or the Newton step would leave the bracket
+                step = mid - (factor - 1.0) / slope if slope > 0 else None
+                if step is None or not low < step < high:
+                    step = (low + high) / 2
+                mid = step
+                
+                factor, slope = erf_fn(mid)
+                
+                if abs(factor - 1.0) < 1e-6:
+                    critical_depth = mid
+                    break
+                elif factor < 1.0:
+                    low = mid
+                else:
+                    high = mid
     
     critical_depth = max(critical_depth, min_critical_depth)
     
@@ -130,14 +377,77 @@ def calculate_remaining_life(diameter, wall_thickness, defect_length, defect_dep
         remaining_corrosion_tolerance = critical_depth - original_depth
     
     return {
-        'min_critical_depth': round(min_critical_depth, 3),
-        'remaining_life': round(remaining_life, 2) if remaining_life != float('inf') else 'Infinite',
-        'remaining_corrosion_tolerance': round(remaining_corrosion_tolerance, 3),
-        'corrosion_rate': round(corrosion_rate, 3),
-        'original_depth': round(original_depth, 3),
-        'wall_thickness': round(wall_thickness, 3)
+        'min_critical_depth': min_critical_depth,
+        'remaining_life': remaining_life if remaining_life != float('inf') else 'Infinite',
+        'remaining_corrosion_tolerance': remaining_corrosion_tolerance,
+        'corrosion_rate': corrosion_rate,
+        'original_depth': original_depth,
+        'wall_thickness': wall_thickness
     }
 
+ASME_PARAMS = ('diameter', 'wall_thickness', 'defect_length', 'defect_depth', 'smys', 'smts', 'maop')
+
+class CalcInput(BaseModel):
+    """Validated /calculate request body"""
+    diameter: PositiveFloat
+    wall_thickness: PositiveFloat
+    defect_length: PositiveFloat
+    defect_depth: PositiveFloat
+    smys: PositiveFloat
+    smts: PositiveFloat
+    maop: PositiveFloat
+    corrosion_rate: float = 0.0
+    method: str = 'asme'
+    safety_class: Literal['low', 'medium', 'high'] = 'medium'
+    
+    @field_validator('corrosion_rate')
+    @classmethod
+    def _corrosion_rate_non_negative(cls, value):
+        if value < 0:
+            raise ValueError('Corrosion rate cannot be negative')
+        return value
+    
+    @model_validator(mode='after')
+    def _depth_within_wall(self):
+        if self.defect_depth > self.wall_thickness:
+            raise ValueError('Defect depth cannot exceed wall thickness')
+        return self
+
+def _field_title(field):
+    """Human-readable name of a request field"""
+    return field.replace("_", " ").title()
+
+def _validation_message(exc):
+    """Turn the first pydantic error into the message shown to the user"""
+    error = exc.errors()[0]
+    field = error['loc'][0] if error['loc'] else None
+    if error['type'] == 'value_error':
+        return str(error['ctx']['error'])
+    if error['type'] == 'greater_than':
+        return f'{_field_title(field)} must be positive'
+    if error['type'] == 'missing':
+        return f'{_field_title(field)} is required'
+    if error['type'] == 'literal_error':
+        return f'{_field_title(field)} must be one of: low, medium, high'
+    return 'Invalid data format. Please ensure all fields contain valid numbers'
+
+# Every fixed message /calculate can answer with, serialized once
+_ERROR_BODIES = {message: orjson.dumps({'error': message}) for message in (
+    *(f'{_field_title(param)} must be positive' for param in ASME_PARAMS),
+    *(f'{_field_title(param)} is required' for param in ASME_PARAMS),
+    'Safety Class must be one of: low, medium, high',
+    'Corrosion rate cannot be negative',
+    'Defect depth cannot exceed wall thickness',
+    'Invalid data format. Please ensure all fields contain valid numbers'
+)}
+
+def _error_response(message, status=400):
+    """JSON error response, reusing the pre-serialized body for fixed messages"""
+    body = _ERROR_BODIES.get(message)
+    if body is None:
+        body = orjson.dumps({'error': message})
+    return Response(body, status=status, mimetype='application/json')
+
 @app.route('/')
 def index():
     """Main page"""
@@ -147,28 +457,15 @@ def index():
 def calculate():
     """API endpoint for calculation"""
     try:
-        data = request.get_json()
-        
-        # Extract and validate parameters
-        required_params = ['diameter', 'wall_thickness', 'defect_length', 'defect_depth', 'smys', 'smts', 'maop']
-        params = {}
+        try:
+            inp = CalcInput.model_validate(request.get_json())
+        except ValidationError as e:
+            return _error_response(_validation_message(e))
         
-        for param in required_params:
-            value = float(data[param])
-            if value <= 0:
-                return jsonify({'error': f'{param.replace("_", " ").title()} must be positive'}), 400
-            params[param] = value
-        
-        # Optional parameters
-        corrosion_rate = float(data.get('corrosion_rate', 0))
-        method = data.get('method', 'asme')
-        safety_class = data.get('safety_class', 'medium')
-        
-        if corrosion_rate < 0:
-            return jsonify({'error': 'Corrosion rate cannot be negative'}), 400
-        
-        if params['defect_depth'] > params['wall_thickness']:
-            return jsonify({'error': 'Defect depth cannot exceed wall thickness'}), 400
+        params = inp.model_dump(include=set(ASME_PARAMS))
+        corrosion_rate = inp.corrosion_rate
+        method = inp.method
+        safety_class = inp.safety_class
         
         # Perform calculation based on selected method
         if method == 'asme':
@@ -184,44 +481,81 @@ def calculate():
             life_results = calculate_remaining_life(
                 params['diameter'], params['wall_thickness'], params['defect_length'],
                 params['defect_depth'], params['smys'], params['smts'], params['maop'],
-                corrosion_rate, method
+                corrosion_rate, method, safety_class, precomputed_erf=results['erf']
             )
             results.update(life_results)
         
-        return jsonify(results)
+        return fastjson(_format_for_display(results))
         
     except ValueError:
-        return jsonify({'error': 'Invalid data format. Please ensure all fields contain valid numbers'}), 400
+        return _error_response('Invalid data format. Please ensure all fields contain valid numbers')
+    except Exception as e:
+        return _error_response(f'Calculation error: {str(e)}', 500)
+
+_BATCH_FORMAT_ERROR = 'Invalid data format. Please provide a list of defects with valid numbers'
+
+@app.route('/calculate_batch', methods=['POST'])
+def calculate_batch():
+    """API endpoint for batch ASME calculation over many defects (JSON or msgpack)"""
+    try:
+        if request.mimetype == 'application/msgpack':
+            data = msgpack.unpackb(request.get_data(), raw=False)
+        else:
+            data = request.get_json()
+        defects = data['defects']
+        if not isinstance(defects, list) or not all(isinstance(defect, dict) for defect in defects):
+            return negotiated({'error': _BATCH_FORMAT_ERROR}, 400)
+        if not defects:
+            return negotiated({'error': 'No defects provided'}, 400)
+        
+        # Per-defect values fall back to pipe-wide values given alongside the list
+        params = {}
+        
+        for param in ASME_PARAMS:
+            column = [defect.get(param, data.get(param)) for defect in defects]
+            if any(value is None for value in column):
+                return negotiated({'error': f'{_field_title(param)} is required'}, 400)
+            values = np.asarray(column, dtype=np.float64)
+            if values.shape != (len(defects),):
+                return negotiated({'error': _BATCH_FORMAT_ERROR}, 400)
+            if not np.all(values > 0):
+                return negotiated({'error': f'{_field_title(param)} must be positive'}, 400)
+            params[param] = values
+        
+        if np.any(params['defect_depth'] > params['wall_thickness']):
+            return negotiated({'error': 'Defect depth cannot exceed wall thickness'}, 400)
+        
+        results = calculate_asme_b31g_modified_vec(**params)
+        
+        response = dict(results)
+        response['method'] = 'ASME B31G Modified'
+        response['count'] = len(defects)
+        return negotiated(response)
+        
+    except (KeyError, TypeError, ValueError):
+        return negotiated({'error': _BATCH_FORMAT_ERROR}, 400)
     except Exception as e:
-        return jsonify({'error': f'Calculation error: {str(e)}'}), 500
+        return negotiated({'error': f'Calculation error: {str(e)}'}, 500)
+
+# Test example, serialized once since it never changes
+_EXAMPLE_JSON = orjson.dumps({
+    'diameter': 506,
+    'wall_thickness': 6.35,
+    'defect_length': 200,
+    'defect_depth': 2.5,
+    'smys': 360,
+    'smts': 455,
+    'maop': 1.5,
+    'corrosion_rate': 0.1,
+    'method': 'asme',
+    'safety_class': 'medium'
+})
 
 @app.route('/example')
 def load_example():
     """Load test example"""
-    example_data = {
-        'diameter': 506,
-        'wall_thickness': 6.35,
-        'defect_length': 200,
-        'defect_depth': 2.5,
-        'smys': 360,
-        'smts': 455,
-        'maop': 1.5,
-        'corrosion_rate': 0.1,
-        'method': 'asme',
-        'safety_class': 'medium'
-    }
-    return jsonify(example_data)
+    return Response(_EXAMPLE_JSON, mimetype='application/json', headers={'Cache-Control': 'public, max-age=3600'})
 
-if __name__ == '__main__':
-    # Create templates directory if it doesn't exist
-    if not os.path.exists('templates'):
-        os.makedirs('templates')
-        print("Created templates directory")
-    
-    port = int(os.environ.get('PORT', 8080))
-    debug = os.environ.get('FLASK_DEBUG', 'False').lower() == 'true'
-    
-# Добавьте это в самый конец файла main.py
 if __name__ == '__main__':
     # Create templates directory if it doesn't exist
     if not os.path.exists('templates'):
@@ -230,10 +564,25 @@ if __name__ == '__main__':
     
     # Use PORT environment variable for Cloud Run, default to 8080 for local
     port = int(os.environ.get('PORT', 8080))
-    debug = os.environ.get('FLASK_DEBUG', 'False').lower() == 'true'
+    debug = os.environ.get('FLASK_DEBUG', '0').lower() in ('1', 'true')
     
     print(f"🚀 Starting Pipeline Defect Calculator on port {port}")
     print("📧 Open: http://localhost:8080")
     print("📧 Or: http://127.0.0.1:8080")
     
-    app.run(host='0.0.0.0', port=port, debug=debug)
+    # Serve with gunicorn (one worker per core) unless FLASK_DEV or FLASK_DEBUG is set
+    if os.environ.get('FLASK_DEV') or debug:
+        app.run(host='0.0.0.0', port=port, debug=debug, use_reloader=False)
+    else:
+        workers = str(os.cpu_count() or 1)
+        # The worker processes already use every core, so parallel batch kernels
+        # get one numba thread each unless NUMBA_NUM_THREADS says otherwise
+        os.environ.setdefault('NUMBA_NUM_THREADS', '1')
+        sys.stdout.flush()
+        try:
+            os.execvp('gunicorn', ['gunicorn', '-w', workers, '-k', 'gthread', '--threads', '4',
+                                   '-b', f'0.0.0.0:{port}',
+                                   '--chdir', os.path.dirname(os.path.abspath(__file__)), 'main:app'])
+        except FileNotFoundError:
+            print("⚠️ gunicorn not found, falling back to the Flask development server")
+            app.run(host='0.0.0.0', port=port, debug=debug, use_reloader=False)